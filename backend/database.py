@@ -1,14 +1,149 @@
 import chromadb
+from contextlib import contextmanager
 import zotero
 import logging
 import llm
 import os
+import shutil
+import sqlite3
 from tqdm import tqdm
 import re
+import threading
 
 logger = logging.getLogger("backend")
-client = chromadb.PersistentClient(path="./data/chroma")
-collection = client.get_or_create_collection(name="zotero")
+DB_PATH = "./data/chroma"
+SNAPSHOT_PATH = "./data/snapshots"
+# all: 单进程模式，直接读写DB_PATH；writer: 读写DB_PATH并发布快照；reader: 只读取最新快照
+role = "all"
+_live_client = None
+_live_collection = None
+_snapshot = None
+_lock = threading.Lock()
+_index_lock = threading.Lock()
+
+
+class _Snapshot:
+    """reader进程中打开的某一代快照，被新快照替换且没有请求在使用时关闭"""
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.client = chromadb.PersistentClient(path=f"{SNAPSHOT_PATH}/{generation}")
+        self.collection = self.client.get_collection(name="zotero")
+        self.refs = 0
+        self.retired = False
+
+    def close(self):
+        _close_client(self.client)
+
+
+def _close_client(client):
+    """
+    停止chromadb客户端的System并从共享缓存中移除
+
+    chromadb没有公开的关闭接口，clear_system_cache只清空缓存而不会停止System。
+    这里依赖SharedSystemClient的内部属性_identifier和_identifier_to_system（chromadb 1.0.x），
+    属性不存在时退回到clear_system_cache，此时旧的System要等客户端被回收后才会释放
+    """
+    cache = getattr(client, "_identifier_to_system", None)
+    identifier = getattr(client, "_identifier", None)
+    if isinstance(cache, dict) and identifier in cache:
+        cache.pop(identifier).stop()
+    else:
+        logger.warning("当前chromadb版本无法停止旧的客户端，退回到clear_system_cache")
+        client.clear_system_cache()
+
+
+def set_role(value: str):
+    """
+    设置进程角色
+
+    writer启动时总是发布一份快照：单进程模式下写入的内容，或上次writer中途退出时写入的内容，
+    都不在已有的快照中
+    """
+    global role
+    role = value
+    if role == "writer":
+        with _index_lock:
+            _get_live_collection()
+            _publish_snapshot()
+
+
+def _latest_generation() -> int | None:
+    if not os.path.isdir(SNAPSHOT_PATH):
+        return None
+    return max((int(e) for e in os.listdir(SNAPSHOT_PATH) if e.isdigit()), default=None)
+
+
+def _get_live_collection():
+    global _live_client, _live_collection
+    with _lock:
+        if _live_collection is None:
+            _live_client = chromadb.PersistentClient(path=DB_PATH)
+            _live_collection = _live_client.get_or_create_collection(name="zotero")
+    return _live_collection
+
+
+def _publish_snapshot():
+    """
+    将当前索引复制为新一代快照
+
+    快照先复制到临时目录再整体重命名，发布后不再修改，多个reader进程可以同时读取。
+    调用方需持有_index_lock，保证复制期间没有写入
+    """
+    os.makedirs(SNAPSHOT_PATH, exist_ok=True)
+    generation = (_latest_generation() or 0) + 1
+    tmp = f"{SNAPSHOT_PATH}/tmp-{generation}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.copytree(DB_PATH, tmp, ignore=shutil.ignore_patterns("chroma.sqlite3*"))
+    # sqlite使用备份接口复制，避免复制到写了一半的数据库或遗漏WAL中的内容
+    src = sqlite3.connect(f"{DB_PATH}/chroma.sqlite3")
+    dst = sqlite3.connect(f"{tmp}/chroma.sqlite3")
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    os.rename(tmp, f"{SNAPSHOT_PATH}/{generation}")
+    logger.info(f"已发布第{generation}代索引快照")
+    # 保留上一代，避免reader刚列出目录时快照就被删除；
+    # Windows下仍被reader打开的快照无法删除，留到下次发布时再清理
+    for e in os.listdir(SNAPSHOT_PATH):
+        if e.isdigit() and int(e) < generation - 1:
+            shutil.rmtree(f"{SNAPSHOT_PATH}/{e}", ignore_errors=True)
+
+
+@contextmanager
+def use_collection():
+    """
+    获取chromadb集合
+
+    reader进程打开writer发布的最新快照，检测到新快照时切换过去，
+    使搜索进程无需重启即可读取到新的索引；旧快照在没有请求使用后关闭
+    """
+    global _snapshot
+    if role != "reader":
+        yield _get_live_collection()
+        return
+    generation = _latest_generation()
+    if generation is None:
+        raise RuntimeError("索引快照尚未发布")
+    with _lock:
+        if _snapshot is None or _snapshot.generation < generation:
+            old = _snapshot
+            _snapshot = _Snapshot(generation)
+            if old is not None:
+                old.retired = True
+                if old.refs == 0:
+                    old.close()
+        snapshot = _snapshot
+        snapshot.refs += 1
+    try:
+        yield snapshot.collection
+    finally:
+        with _lock:
+            snapshot.refs -= 1
+            if snapshot.retired and snapshot.refs == 0:
+                snapshot.close()
 
 
 def tqdm_info(msg):
@@ -18,39 +153,58 @@ def tqdm_info(msg):
 
 def index_collections(collection_keys: list[str]):
     """
-    索引指定文献集中的所有文献
+    索引指定文献集中的所有文献，同一时间只允许一个索引任务写入
 
     Args:
         collection_keys (list[str]): 文献集的唯一标识符列表
     """
+    if not _index_lock.acquire(blocking=False):
+        yield "等待其他索引任务完成"
+        _index_lock.acquire()
+    try:
+        return (yield from _index_collections(collection_keys))
+    finally:
+        _index_lock.release()
+
+
+def _index_collections(collection_keys: list[str]):
     item_keys = {}
     for key in collection_keys:
         items = zotero.get_pdf_path_in_collection(key)
         item_keys.update({e["key"]: e for e in items})
     logger.info(f"Indexing collections {collection_keys} with {len(item_keys)} items")
     item_keys = list(item_keys.values())
-    for i, e in tqdm(enumerate(item_keys)):
-        yield f"正在索引 {i + 1}/{len(item_keys)}"
-        pdf_key = e["key"]
-        pdf_path = e["path"]
-        mod = int(os.path.getmtime(pdf_path))
-        res = collection.get(where={"key": pdf_key}, include=["metadatas"])
-        ids = res["ids"]
-        if ids:
-            if res["metadatas"][0]["mod"] >= mod:
-                continue
-            else:
-                collection.delete(ids=ids)
-        text = zotero.get_pdf_text(pdf_path)
-        chunks = llm.split_text(text)
-        count = len(chunks)
-        embeddings = [e["embedding"] for e in llm.get_text_embedding(chunks)]
-        collection.add(
-            documents=chunks,
-            metadatas=[{"key": pdf_key, "mod": mod}] * count,
-            ids=[f"{pdf_key}_{i}" for i in range(count)],
-            embeddings=embeddings,
-        )
+    collection = _get_live_collection()
+    updated = False
+    try:
+        for i, e in tqdm(enumerate(item_keys)):
+            yield f"正在索引 {i + 1}/{len(item_keys)}"
+            pdf_key = e["key"]
+            pdf_path = e["path"]
+            mod = int(os.path.getmtime(pdf_path))
+            res = collection.get(where={"key": pdf_key}, include=["metadatas"])
+            ids = res["ids"]
+            if ids:
+                if res["metadatas"][0]["mod"] >= mod:
+                    continue
+                else:
+                    updated = True
+                    collection.delete(ids=ids)
+            text = zotero.get_pdf_text(pdf_path)
+            chunks = llm.split_text(text)
+            count = len(chunks)
+            embeddings = [e["embedding"] for e in llm.get_text_embedding(chunks)]
+            collection.add(
+                documents=chunks,
+                metadatas=[{"key": pdf_key, "mod": mod}] * count,
+                ids=[f"{pdf_key}_{i}" for i in range(count)],
+                embeddings=embeddings,
+            )
+            updated = True
+    finally:
+        # 即使中途出错或客户端断开，已写入的内容也要发布出去
+        if updated and role == "writer":
+            _publish_snapshot()
     logger.info("索引完成")
     return "已完成！"
 
@@ -64,8 +218,8 @@ def get_document_by_key(key: str):
     Returns:
         dict: 包含文档内容和信息的字典
     """
-    res = collection.get(ids=[key])
-    print(res)
+    with use_collection() as collection:
+        res = collection.get(ids=[key])
     item_key = key.split("_")[0]
     item = zotero.get_item_info(item_key)
     title = item["title"]
@@ -80,6 +234,43 @@ def get_document_by_key(key: str):
     }
 
 
+def get_documents_by_keys(keys: list[str]):
+    """
+    批量获取文档内容和信息
+
+    只进行一次chromadb查询和一次文献信息批量查询
+
+    Args:
+        keys (list[str]): chromadb中存储的id列表，格式为"{item_key}_{chunk_index}"
+    Returns:
+        list: 包含文档内容和信息的字典列表，顺序与keys一致，不存在的id会被跳过
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return []
+    with use_collection() as collection:
+        res = collection.get(ids=keys, include=["documents"])
+    documents = dict(zip(res["ids"], res["documents"]))
+    items = zotero.get_items_info([key.split("_")[0] for key in documents])
+    ret = []
+    for key in keys:
+        if key not in documents:
+            continue
+        item_key = key.split("_")[0]
+        item = items.get(item_key, {})
+        ret.append(
+            {
+                "id": key,
+                "key": item_key,
+                "pdf_key": item.get("pdf_key"),
+                "title": item.get("title", ""),
+                "publication": item.get("publication", ""),
+                "text": documents[key],
+            }
+        )
+    return ret
+
+
 def semantic_search(queries: list[str], collections: list[str], n_results: int = 10):
     """
     语义搜索，合并所有查询结果并按距离升序排列
@@ -99,11 +290,12 @@ def semantic_search(queries: list[str], collections: list[str], n_results: int =
         res = zotero.get_items_in_collection(c)
         keys.extend([e["key"] for e in res])
     logger.info("在数据库中查询嵌入表示")
-    results = collection.query(
-        query_embeddings=query_embeddings,
-        where={"key": {"$in": keys}},
-        n_results=n_results,
-    )
+    with use_collection() as collection:
+        results = collection.query(
+            query_embeddings=query_embeddings,
+            where={"key": {"$in": keys}},
+            n_results=n_results,
+        )
     logger.info("处理查询结果")
     resmap = {}
     for i in range(len(queries)):
@@ -150,7 +342,8 @@ def get_fulltext(key: str, no_db: bool = False) -> str:
         if not pdf_path:
             return ""
         return zotero.get_pdf_text(pdf_path)
-    res = collection.get(where={"key": key})
+    with use_collection() as collection:
+        res = collection.get(where={"key": key})
     texts = res["documents"]
     # 去掉texts[i]结尾与texts[i+1]开头重复的部分，要计算重复长度
     full_text = texts[0]
@@ -212,10 +405,11 @@ def fulltext_search(queries: list[str], collections: list[str], ignore_case: boo
         keys.extend([e["key"] for e in res])
     if not no_db:
         logger.info(f"文档总数: {len(keys)}，开始在数据库中过滤")
-        res = collection.get(
-            where_document={"$regex": "(?i)" + query if ignore_case else query},
-            where={"key": {"$in": keys}},
-        )
+        with use_collection() as collection:
+            res = collection.get(
+                where_document={"$regex": "(?i)" + query if ignore_case else query},
+                where={"key": {"$in": keys}},
+            )
 
         keys = set()
         for i in range(len(res["ids"])):
@@ -3,7 +3,12 @@ from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from scalar_fastapi import get_scalar_api_reference
 from config import config
+import multiprocessing
 import json
+import os
+import socket
+import time
+import httpx
 import uvicorn
 import logging
 import zotero
@@ -11,6 +16,10 @@ import llm
 import database
 
 logger = logging.getLogger("backend")
+server_config = {"host": "127.0.0.1", "port": 8000, "workers": 1, "writer_port": 8001} | config.get("server", {})
+# all: 单进程模式；reader: 只负责搜索，索引请求转发给writer；writer: 独占索引写入
+role = os.environ.get("ZOTERO_ASSISTANT_ROLE", "all")
+database.set_role(role)
 app = FastAPI(title="Zotero Assistant API")
 router = APIRouter(prefix="/api")
 
@@ -45,9 +54,29 @@ def embedding_text(text: str):
 def index_collections(collections: list[str]):
     """索引指定文献集中的所有文献"""
     # return database.index_collections(collections)
+    if role == "reader":
+        return StreamingResponse(forward_index_collections(collections), media_type="text/event-stream")
     return StreamingResponse(database.index_collections(collections), media_type="text/event-stream")
 
 
+def forward_index_collections(collections: list[str]):
+    """将索引请求转发给writer进程，并流式返回进度"""
+    url = f"http://127.0.0.1:{server_config['writer_port']}/api/index_collections"
+    try:
+        with httpx.stream("POST", url, json=collections, timeout=None) as res:
+            if res.status_code != 200:
+                yield f"索引失败：writer进程返回 {res.status_code}"
+                return
+            yield from res.iter_text()
+    except httpx.ConnectError as e:
+        logger.error(f"无法连接writer进程: {e}")
+        yield f"索引失败：无法连接writer进程（{e}）"
+    except httpx.HTTPError as e:
+        # 连接成功后出错，通常是writer索引过程中抛出异常（如Zotero或嵌入接口不可用）
+        logger.error(f"writer进程索引失败: {e}")
+        yield "索引失败：writer进程索引时出错，详见writer日志"
+
+
 @router.post("/semantic_search")
 def semantic_search(query: list[str], collections: list[str], n_results: int = 10):
     """语义搜索"""
@@ -74,6 +103,12 @@ def get_document(key: str):
     return database.get_document_by_key(key)
 
 
+@router.post("/get_documents")
+def get_documents(keys: list[str]):
+    """根据key列表批量获取文档内容"""
+    return database.get_documents_by_keys(keys)
+
+
 @router.get("/item/{key}")
 def get_item_info(key: str):
     """根据key获取文献的详细信息"""
@@ -94,6 +129,16 @@ def export_document(key: str):
     return {"message": f"Exported PDF {key} to {path}"}
 
 
+@router.post("/export_zip")
+def export_zip(keys: list[str]):
+    """将多个PDF文件打包为ZIP流式下载"""
+    return StreamingResponse(
+        zotero.stream_pdfs_zip(keys),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="export.zip"'},
+    )
+
+
 @router.get("/open_export_path")
 def open_export_path():
     """打开导出文件夹"""
@@ -127,7 +172,59 @@ def catch_all(request, exc):
     return FileResponse(config["static_path"] + "/index.html")
 
 
-if __name__ == "__main__":
+def setup_logging():
     logging.basicConfig(level=logging.WARN, format="%(asctime)s [%(levelname)s] %(message)s")
     logger.setLevel(logging.INFO)
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+
+
+def run_writer():
+    """writer进程：独占索引写入，只监听本机"""
+    os.environ["ZOTERO_ASSISTANT_ROLE"] = "writer"
+    uvicorn.run("main:app", host="127.0.0.1", port=server_config["writer_port"])
+
+
+def is_port_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_writer(writer: multiprocessing.Process, timeout: float = 60):
+    """等待writer进程开始监听端口，此时初始快照已经发布"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not writer.is_alive():
+            raise RuntimeError("writer进程启动失败")
+        if is_port_open(server_config["writer_port"]):
+            # 端口可能被其他进程占用，writer绑定失败后会立即退出，稍等再确认一次
+            time.sleep(0.5)
+            if not writer.is_alive():
+                raise RuntimeError("writer进程启动失败")
+            return
+        time.sleep(0.2)
+    raise RuntimeError("等待writer进程启动超时")
+
+
+if role != "all":
+    # 多进程模式下uvicorn会在子进程中重新导入本模块，需要在这里配置日志
+    setup_logging()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    workers = server_config["workers"]
+    if workers <= 1:
+        uvicorn.run(app, host=server_config["host"], port=server_config["port"])
+    else:
+        if is_port_open(server_config["writer_port"]):
+            raise RuntimeError(f"writer端口{server_config['writer_port']}已被占用，请检查是否有旧的实例仍在运行")
+        writer = multiprocessing.Process(target=run_writer, daemon=True)
+        writer.start()
+        wait_for_writer(writer)
+        os.environ["ZOTERO_ASSISTANT_ROLE"] = "reader"
+        try:
+            uvicorn.run("main:app", host=server_config["host"], port=server_config["port"], workers=workers)
+        finally:
+            writer.terminate()
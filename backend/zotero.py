@@ -2,7 +2,9 @@ import os
 import logging
 import httpx
 import pymupdf
+import re
 import shutil
+import zipfile
 from config import config
 
 logger = logging.getLogger("backend")
@@ -31,6 +33,11 @@ def get_items_in_collection(collection_key: str):
     return [{"key": e["key"], "title": e["data"].get("title", "Untitled")} for e in res.json()]
 
 
+def is_valid_key(key: str) -> bool:
+    """检查是否为合法的Zotero key（8位大写字母或数字），防止拼接路径时越出storage目录"""
+    return isinstance(key, str) and re.fullmatch(r"[A-Z0-9]{8}", key) is not None
+
+
 def find_pdf_file_by_key(pdf_key: str) -> str:
     """
     根据pdf_key查找PDF文件的路径
@@ -43,8 +50,13 @@ def find_pdf_file_by_key(pdf_key: str) -> str:
     Returns:
         str: 找到的PDF文件的路径，如果未找到则返回None
     """
+    if not is_valid_key(pdf_key):
+        logger.warning(f"Invalid key {pdf_key!r}. Skipping.")
+        return None
     zotero_path = config["zotero_path"]
     path = f"{zotero_path}/storage/{pdf_key}"
+    if not os.path.isdir(path):
+        return None
     for e in os.listdir(path):
         if os.path.splitext(e)[1] == ".pdf":
             return f"{path}/{e}"
@@ -108,6 +120,38 @@ def get_item_info(item_key: str):
     return info
 
 
+def get_items_info(item_keys: list[str]):
+    """
+    批量获取文献的详细信息
+
+    Zotero api每次最多接受50个itemKey，超出部分分批请求
+
+    Args:
+        item_keys (list[str]): 文献的唯一标识符列表
+
+    Returns:
+        dict: 以item_key为键的文献详细信息，未找到的文献不包含在内
+    """
+    item_keys = list(dict.fromkeys(item_keys))  # 去重并保持顺序
+    infos = {}
+    for i in range(0, len(item_keys), 50):
+        batch = item_keys[i : i + 50]
+        res = client.get("items", params={"itemKey": ",".join(batch), "limit": 50})
+        if res.status_code != 200:
+            logger.warning(f"Failed to get items {batch}: {res.status_code}")
+            continue
+        for data in res.json():
+            pdf_key = None
+            if "attachment" in data["links"]:
+                pdf_key = data["links"]["attachment"]["href"][-8:]
+            infos[data["key"]] = {
+                "title": data["data"].get("title", ""),
+                "pdf_key": pdf_key,
+                "publication": data["data"].get("publicationTitle", ""),
+            }
+    return infos
+
+
 def open_pdf(pdf_key: str):
     """
     使用用户默认的PDF阅读器打开PDF文件
@@ -142,6 +186,62 @@ def export_pdf(pdf_key: str) -> str:
     shutil.copy(pdf_path, export_path)
 
 
+class _ZipStream:
+    """只写的文件对象，供zipfile写入后由生成器取走数据"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def stream_pdfs_zip(pdf_keys: list[str], chunk_size: int = 1024 * 1024):
+    """
+    将多个PDF文件打包为ZIP并流式输出
+
+    直接从storage目录读取，不产生临时文件。PDF本身已压缩，因此只存储不压缩
+
+    Args:
+        pdf_keys (list[str]): PDF文件的唯一标识符列表
+        chunk_size (int): 每次读取的字节数
+
+    Yields:
+        bytes: ZIP文件的数据块
+    """
+    stream = _ZipStream()
+    names = set()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as zf:
+        for pdf_key in dict.fromkeys(pdf_keys):
+            pdf_path = find_pdf_file_by_key(pdf_key)
+            if not pdf_path:
+                logger.warning(f"PDF file of {pdf_key} not found. Skipping.")
+                continue
+            name = os.path.basename(pdf_path)
+            if name in names:
+                name = f"{pdf_key}_{name}"
+            names.add(name)
+            with open(pdf_path, "rb") as src, zf.open(name, "w", force_zip64=True) as dst:
+                while data := src.read(chunk_size):
+                    dst.write(data)
+                    yield stream.take()
+    yield stream.take()
+
+
 def open_export_path():
     """打开导出PDF文件的文件夹"""
     export_path = "data/export"